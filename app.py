@@ -22,9 +22,10 @@ if uploaded_file:
             try:
                 # Process the file using the refactored function
                 # Read bytes from uploaded file
-                input_bytes = uploaded_file.read()
+                input_bytes = uploaded_file.getvalue()
                 
                 # Get processed output bytes and pine script
+                # process_excel_file caches on the file content, so re-clicks with the same file are instant
                 output_bytes, pine_script = process_excel_file(input_bytes)
                 
                 if output_bytes:
@@ -1,75 +1,144 @@
+import logging
 import pandas as pd
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from python_calamine import CalamineWorkbook, WorksheetNotFound
 
-def process_sheet(file_path, sheet_name):
+logger = logging.getLogger(__name__)
+
+def process_sheet(wb, sheet_name):
     try:
-        # Read first few rows to find header
-        # We look for a row containing 'Strike' or 'Chg in OI Value'
-        df_preview = pd.read_excel(file_path, sheet_name=sheet_name, header=None, nrows=10)
+        # Pull the raw cell values once; no DataFrame is built until the header is known
+        rows = wb.get_sheet_by_name(sheet_name).to_python()
         
+        # Look for a row containing 'Strike' or 'Chg in OI Value' in the first few rows
+        # Lower-case the whole preview block at once and flag rows containing a keyword
+        # (an empty sheet has no rows to preview and falls through to the no-header case)
         header_row_idx = -1
-        for i, row in df_preview.iterrows():
-            # Convert row to string and check for keywords
-            row_str = row.astype(str).str.lower().tolist()
-            if 'strike' in row_str or 'chg in oi value' in row_str:
-                header_row_idx = i
-                break
+        if rows:
+            cells = np.char.lower(np.array(rows[:10], dtype=str))
+            is_header = np.isin(cells, ['strike', 'chg in oi value']).any(axis=1)
+            if is_header.any():
+                header_row_idx = int(is_header.argmax())
         
         if header_row_idx == -1:
-            print(f"Could not find header row in sheet {sheet_name}")
+            logger.warning("Could not find header row in sheet %s", sheet_name)
             return pd.DataFrame()
             
-        # Read identifying the header row
-        df = pd.read_excel(file_path, sheet_name=sheet_name, header=header_row_idx)
+        # Trim column names to handle potential whitespace
+        # Repeated names get a '.1', '.2'... suffix, the same way pandas labels duplicate headers
+        columns = []
+        seen = {}
+        for name in rows[header_row_idx]:
+            name = str(name).strip()
+            count = seen.get(name, 0)
+            seen[name] = count + 1
+            columns.append(name if count == 0 else f"{name}.{count}")
         
-        # Convert columns to numeric, coercing errors to NaN
-        # Also trim column names to handle potential whitespace
-        df.columns = df.columns.astype(str).str.strip()
+        # Raw column -> internal name (the '.1' duplicates are the Put side)
+        column_map = {
+            'Strike': 'Strike',
+            'Chg in OI Value': 'Call_Chg_OI_Val',
+            'VWAP': 'Call_VWAP',
+            'LTP (Chg %)': 'Call_LTP',
+            'Chg in OI Value.1': 'Put_Chg_OI_Val',
+            'VWAP.1': 'Put_VWAP',
+            'LTP (Chg %).1': 'Put_LTP',
+        }
         
-        df['Strike'] = pd.to_numeric(df['Strike'], errors='coerce')
-        df['Call_Chg_OI_Val'] = pd.to_numeric(df['Chg in OI Value'], errors='coerce')
-        df['Call_VWAP'] = pd.to_numeric(df['VWAP'], errors='coerce')
-        df['Call_LTP'] = pd.to_numeric(df['LTP (Chg %)'], errors='coerce')
+        # Keep only the columns we use (both Call and Put occurrences)
+        keep = [i for i, name in enumerate(columns) if name in column_map]
+        data = np.array(rows[header_row_idx + 1:], dtype=object).reshape(-1, len(columns))[:, keep]
+        df = pd.DataFrame(data, columns=[columns[i] for i in keep])
         
-        df['Put_Chg_OI_Val'] = pd.to_numeric(df['Chg in OI Value.1'], errors='coerce')
-        df['Put_VWAP'] = pd.to_numeric(df['VWAP.1'], errors='coerce')
-        df['Put_LTP'] = pd.to_numeric(df['LTP (Chg %).1'], errors='coerce')
+        # Convert the whole block to numeric in one pass, coercing errors to NaN
+        df = df[list(column_map)].rename(columns=column_map).apply(pd.to_numeric, errors='coerce')
 
-        # Drop rows where Strike is NaN
-        df = df.dropna(subset=['Strike'])
-        
-        # Fill NaNs with 0 for aggregation of Chg OI
-        cols_to_fill = ['Call_Chg_OI_Val', 'Put_Chg_OI_Val', 'Call_VWAP', 'Put_VWAP', 'Call_LTP', 'Put_LTP']
-        df[cols_to_fill] = df[cols_to_fill].fillna(0)
+        # Drop rows where Strike is NaN, then fill NaNs with 0 for aggregation of Chg OI
+        df = df.dropna(subset=['Strike']).fillna(0)
         
         # Return RAW columns so we can decide later based on consistency
-        return df[['Strike', 'Call_Chg_OI_Val', 'Call_VWAP', 'Call_LTP', 'Put_Chg_OI_Val', 'Put_VWAP', 'Put_LTP']]
+        return df
+    except WorksheetNotFound:
+        # The exception text is only the sheet name, so spell the problem out
+        logger.error("Error processing sheet %s: Worksheet named '%s' not found", sheet_name, sheet_name)
+        return pd.DataFrame()
     except Exception as e:
-        print(f"Error processing sheet {sheet_name}: {e}")
+        logger.error("Error processing sheet %s: %s", sheet_name, e)
         # Debug: Print columns to help identify why 'Strike' might be missing
         try:
-             print(f"Columns in {sheet_name}: {df.columns.tolist()}")
+             if logger.isEnabledFor(logging.DEBUG):
+                 logger.debug("Columns in %s: %s", sheet_name, df.columns.tolist())
         except:
              pass
         return pd.DataFrame()
 
+def aggregate_strikes(combined_df):
+    # Order rows by (Strike, Sheet_Index) so the first row of each strike group is its first day
+    order = np.lexsort((combined_df['Sheet_Index'].to_numpy(), combined_df['Strike'].to_numpy()))
+    strikes = combined_df['Strike'].to_numpy()[order]
+    
+    # Group boundaries are the positions where the strike changes
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(strikes)) + 1))
+    counts = np.diff(np.append(starts, len(strikes)))
+    group_ids = np.repeat(np.arange(len(starts)), counts)
+    
+    dataset = {'Strike': strikes[starts]}
+    for side in ['Call', 'Put']:
+        vwap = combined_df[f'{side}_VWAP'].to_numpy()[order]
+        ltp = combined_df[f'{side}_LTP'].to_numpy()[order]
+        oi = combined_df[f'{side}_Chg_OI_Val'].to_numpy()[order]
+        
+        # Check First Day Condition
+        # If first day VWAP is valid (>0), we stick to standard logic (VWAP, fallback to LTP per day)
+        # If first day VWAP is INVALID (<=0), we force LTP for ALL days.
+        force_ltp = np.repeat(vwap[starts] <= 0, counts)
+        ref_price = np.where(force_ltp | (vwap <= 0), ltp, vwap)
+        
+        # Sum Change in OI, average Ref Price
+        # The ref sum goes through bincount: its summation order matches the pandas mean on half-paisa averages
+        dataset[f'{side}_Chg_OI_Val'] = np.add.reduceat(oi, starts)
+        dataset[f'{side}_Ref_Price'] = np.bincount(group_ids, weights=ref_price) / counts
+    
+    return pd.DataFrame(dataset)
+
 def calculate_levels(file_path, sheet_names):
     all_data = []
     
-    # Process each sheet
-    for sheet in sheet_names:
-        print(f"Processing sheet: {sheet}")
-        df = process_sheet(file_path, sheet)
-        if not df.empty:
-            df['Sheet_Index'] = sheet_names.index(sheet) # Track order
-            all_data.append(df)
+    def load_sheet(sheet):
+        logger.debug("Processing sheet: %s", sheet)
+        # A CalamineWorkbook handle can't be shared between threads, so each worker opens its own
+        # calamine (Rust) parses xlsx much faster than the default openpyxl engine
+        with CalamineWorkbook.from_path(file_path) as wb:
+            return process_sheet(wb, sheet)
+    
+    # Sheets are independent, so parse them concurrently
+    with ThreadPoolExecutor(max_workers=max(1, min(8, len(sheet_names)))) as executor:
+        # Process each sheet (map yields results in sheet order)
+        for i, df in enumerate(executor.map(load_sheet, sheet_names)):
+            if not df.empty:
+                df['Sheet_Index'] = np.int8(i) # Track order
+                all_data.append(df)
     
     if not all_data:
-        print("No valid data found.")
-        return
+        logger.warning("No valid data found.")
+        return None
 
     # Aggregate data
-    combined_df = pd.concat(all_data)
+    # Slot each sheet's columns into preallocated arrays rather than copying through pd.concat
+    sizes = [len(df) for df in all_data]
+    total_rows = sum(sizes)
+    # Values are float64 whatever a single sheet inferred (an all-integer column must not truncate the others)
+    combined = {col: np.empty(total_rows, dtype=np.float64) for col in all_data[0].columns}
+    combined['Sheet_Index'] = np.empty(total_rows, dtype=np.int8)
+    
+    offset = 0
+    for df, size in zip(all_data, sizes):
+        for col, values in combined.items():
+            values[offset:offset + size] = df[col].to_numpy()
+        offset += size
+    
+    combined_df = pd.DataFrame(combined, copy=False)
     
     # Logic for Consistency:
     # If the FIRST day (sheet_index 0) uses LTP (because VWAP was 0), then ALL days must use LTP.
@@ -91,75 +160,36 @@ def calculate_levels(file_path, sheet_names):
     #    Else:
     #       Call_Ref_Price_Daily = Call_VWAP (if > 0 else Call_LTP) (per day standard logic)
     
-    # To do this efficiently with pandas:
-    # We need to preserve the daily rows.
-    
-    def calculate_group_ref_price(group, side='Call'):
-        # Sort by Sheet Index to ensure chronological order
-        group = group.sort_values('Sheet_Index')
-        
-        first_day = group.iloc[0]
-        vwap_col = f'{side}_VWAP'
-        ltp_col = f'{side}_LTP'
-        
-        # Check First Day Condition
-        # If first day VWAP is valid (>0), we stick to standard logic (VWAP, fallback to LTP per day)
-        # If first day VWAP is INVALID (<=0), we force LTP for ALL days.
-        
-        force_ltp = False
-        if first_day[vwap_col] <= 0:
-            force_ltp = True
-            
-        prices = []
-        for _, row in group.iterrows():
-            if force_ltp:
-                price = row[ltp_col]
-            else:
-                # Standard logic: VWAP if valid, else LTP
-                price = row[vwap_col] if row[vwap_col] > 0 else row[ltp_col]
-            prices.append(price)
-            
-        return pd.Series({'Avg_Ref_Price': np.mean(prices)})
+    # Aggregate per strike on strike-sorted NumPy arrays
+    dataset = aggregate_strikes(combined_df)
 
-    grouped = combined_df.groupby('Strike')
-    
-    # 1. Sum Change in OI
-    agg_oi = grouped[['Call_Chg_OI_Val', 'Put_Chg_OI_Val']].sum()
+    # --- Call Side (Resistance) ---
+    top_calls = dataset.nlargest(5, 'Call_Chg_OI_Val')
+    top_calls = top_calls.assign(Resistance=top_calls['Strike'] + top_calls['Call_Ref_Price'])
     
-    # 2. Calculate Average Ref Price with Consistency Logic
-    # This apply is a bit slow but safe for logic complexity
-    call_prices = grouped.apply(calculate_group_ref_price, side='Call', include_groups=False)
-    put_prices = grouped.apply(calculate_group_ref_price, side='Put', include_groups=False)
+    # --- Put Side (Support) ---
+    top_puts = dataset.nlargest(5, 'Put_Chg_OI_Val')
+    top_puts = top_puts.assign(Support=top_puts['Strike'] - top_puts['Put_Ref_Price'])
     
-    # Merge results
-    dataset = agg_oi.join(call_prices.rename(columns={'Avg_Ref_Price': 'Call_Ref_Price'}))
-    dataset = dataset.join(put_prices.rename(columns={'Avg_Ref_Price': 'Put_Ref_Price'}))
-    dataset = dataset.reset_index()
+    return top_calls, top_puts
 
-    # --- Call Side (Resistance) ---
-    top_calls = dataset.sort_values(by='Call_Chg_OI_Val', ascending=False).head(5)
-    
+def print_levels(top_calls, top_puts):
     print("\n--- TOP 5 RESISTANCE LEVELS (Calls) ---")
     print(f"{'Rank':<5} {'Strike':<10} {'Cum Chg OI':<15} {'Avg Ref Price':<15} {'Resistance':<15}")
     print("-" * 75)
     
     rank = 1
     for _, row in top_calls.iterrows():
-        resistance = row['Strike'] + row['Call_Ref_Price']
-        print(f"{rank:<5} {row['Strike']:<10} {row['Call_Chg_OI_Val']:<15.2f} {row['Call_Ref_Price']:<15.2f} {resistance:<15.2f}")
+        print(f"{rank:<5} {row['Strike']:<10} {row['Call_Chg_OI_Val']:<15.2f} {row['Call_Ref_Price']:<15.2f} {row['Resistance']:<15.2f}")
         rank += 1
         
-    # --- Put Side (Support) ---
-    top_puts = dataset.sort_values(by='Put_Chg_OI_Val', ascending=False).head(5)
-    
     print("\n--- TOP 5 SUPPORT LEVELS (Puts) ---")
     print(f"{'Rank':<5} {'Strike':<10} {'Cum Chg OI':<15} {'Avg Ref Price':<15} {'Support':<15}")
     print("-" * 75)
     
     rank = 1
     for _, row in top_puts.iterrows():
-        support = row['Strike'] - row['Put_Ref_Price']
-        print(f"{rank:<5} {row['Strike']:<10} {row['Put_Chg_OI_Val']:<15.2f} {row['Put_Ref_Price']:<15.2f} {support:<15.2f}")
+        print(f"{rank:<5} {row['Strike']:<10} {row['Put_Chg_OI_Val']:<15.2f} {row['Put_Ref_Price']:<15.2f} {row['Support']:<15.2f}")
         rank += 1
 
 if __name__ == "__main__":
@@ -172,10 +202,17 @@ if __name__ == "__main__":
     
     import os
     
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    def run(file_path, sheet_names):
+        levels = calculate_levels(file_path, sheet_names)
+        if levels is not None:
+            print_levels(*levels)
+    
     if os.path.exists(target_file):
         print(f"Found target file: {target_file}")
         # Check if sheets exist? process_sheet handles errors for missing sheets, but let's see.
-        calculate_levels(target_file, target_sheets)
+        run(target_file, target_sheets)
     elif os.path.exists(fallback_file):
         print(f"Target file '{target_file}' not found.")
         print(f"Found fallback file: {fallback_file}")
@@ -183,7 +220,7 @@ if __name__ == "__main__":
         try:
             xl = pd.ExcelFile(fallback_file)
             print(f"Sheets found: {xl.sheet_names}")
-            calculate_levels(fallback_file, xl.sheet_names)
+            run(fallback_file, xl.sheet_names)
         except Exception as e:
             print(f"Error reading fallback file: {e}")
     else:
@@ -4,17 +4,24 @@ import numpy as np
 import re
 import os
 import io
+import hashlib
+import threading
+from collections import OrderedDict
+import openpyxl
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, Side
+from openpyxl.utils import get_column_letter
+
+# Regex to match day names like tue, wed, Thu, fri, mon followed by numbers or nothing
+# Anchored on a day prefix, so the generated 'Total' and 'Max' sheets never match
+_DAY_PATTERN = re.compile(r'^(tue|wed|thu|fri|mon|sun|sat)', re.IGNORECASE)
+
+# Results of recent runs keyed on a hash of the input workbook, least recently used evicted first
+_RESULT_CACHE = OrderedDict()
+_RESULT_CACHE_SIZE = 8
+_RESULT_CACHE_LOCK = threading.Lock()
 
 def get_day_sheets(xl):
-    # Regex to match day names like tue, wed, Thu, fri, mon followed by numbers or nothing
-    # Excluding 'Total', 'Max'
-    sheet_names = xl.sheet_names
-    day_pattern = re.compile(r'^(tue|wed|thu|fri|mon|sun|sat)', re.IGNORECASE)
-    
-    day_sheets = []
-    for sheet in sheet_names:
-        if day_pattern.match(sheet) and sheet.lower() not in ['total', 'max']:
-            day_sheets.append(sheet)
+    day_sheets = [sheet for sheet in xl.sheet_names if _DAY_PATTERN.match(sheet)]
             
     # Sort sheets? Ideally order matters (Tue, Wed, Thu...) if we do cumulative.
     # For now, let's trust the order in the file or sort manually if needed.
@@ -23,52 +30,129 @@ def get_day_sheets(xl):
     # Best guess: use the order they appear in the file.
     return day_sheets
 
-def process_sheet_data(xl, sheet_name):
+def get_column_widths(df):
+    # Auto-fit width (longest non-empty value + 2 padding) for each column as to_excel lays it out
+    # with MultiIndex headers: the level-0 label sits only in the first column of its merged run,
+    # the level-1 label in every column, then the data. Empty and zero cells don't count.
+    data = df.set_axis(range(df.shape[1]), axis=1)
+    data = data.where(data.notna() & data.ne(0))
+    widths = data.map(lambda v: len(str(v)), na_action='ignore').max().fillna(0)
+    
+    prev_top = None
+    for i, (top, sub) in enumerate(df.columns):
+        if top and top != prev_top:
+            widths[i] = max(widths[i], len(str(top)))
+        if sub:
+            widths[i] = max(widths[i], len(str(sub)))
+        prev_top = top
+    
+    return [int(w) + 2 for w in widths]
+
+def write_sheet(wb, sheet_name, df):
+    # Lay df out the way DataFrame.to_excel does for MultiIndex columns: one merged header row per
+    # level, an index-name row, then the data with the index in column A. Headers and the index get
+    # the usual bold / thin border / centered header style.
+    if sheet_name in wb.sheetnames:
+        # Replace in place so the sheet keeps its position in the workbook
+        position = wb.sheetnames.index(sheet_name)
+        del wb[sheet_name]
+        ws = wb.create_sheet(sheet_name, position)
+    else:
+        ws = wb.create_sheet(sheet_name)
+    
+    header_font = Font(bold=True)
+    header_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    header_alignment = Alignment(horizontal='center', vertical='top')
+    
+    def style_header(cell):
+        cell.font = header_font
+        cell.border = header_border
+        cell.alignment = header_alignment
+    
+    # Header rows: a label spans the following columns while they repeat it (outer levels) or are blank.
+    # A column whose outer label starts a new span starts a new span on the inner levels too.
+    n_levels = df.columns.nlevels
+    n_cols = len(df.columns)
+    starts_span = [False] * n_cols
+    for level in range(n_levels):
+        labels = df.columns.get_level_values(level)
+        row = [None] * n_cols
+        for j, label in enumerate(labels):
+            repeated = level < n_levels - 1 and j > 0 and label == labels[j - 1] and not starts_span[j]
+            if (label != '' and not repeated) or starts_span[j] or j == 0:
+                starts_span[j] = True
+                row[j] = label
+        ws.append([None] + row)
+        
+        # Level name cell in the index column, then merge and style each span
+        style_header(ws.cell(row=level + 1, column=1))
+        span_starts = [j for j in range(n_cols) if row[j] is not None] + [n_cols]
+        for start, end in zip(span_starts, span_starts[1:]):
+            if end - start > 1:
+                ws.merge_cells(start_row=level + 1, start_column=start + 2, end_row=level + 1, end_column=end + 1)
+            for c in range(start + 2, end + 2):
+                style_header(ws.cell(row=level + 1, column=c))
+    
+    # Index-name row
+    ws.append([df.index.name])
+    if df.index.name is not None:
+        style_header(ws.cell(row=n_levels + 1, column=1))
+    
+    # Data: convert the block once, blanks (NaN) become empty cells
+    values = df.to_numpy(dtype=object, na_value=None)
+    for label, row in zip(df.index, values.tolist()):
+        ws.append([label] + row)
+    
+    for (cell,) in ws.iter_rows(min_row=n_levels + 2, max_row=n_levels + 1 + len(df), min_col=1, max_col=1):
+        style_header(cell)
+    
+    return ws
+
+def process_sheet_data(df_raw, sheet_name):
+    # df_raw is the sheet read with header=None; the header row is found and promoted below
     try:
-        # Dynamic header finding (reuse logic)
-        # pd.read_excel supports ExcelFile object
-        df_preview = pd.read_excel(xl, sheet_name=sheet_name, header=None, nrows=10)
-        header_row = -1
-        for i, row in df_preview.iterrows():
-            row_str = row.astype(str).str.lower().tolist()
-            if 'strike' in row_str or 'chg in oi value' in row_str:
-                header_row = i
-                break
+        # Dynamic header finding (reuse logic): first of the top 10 rows holding a keyword, case-insensitive
+        cells = np.char.lower(df_raw.head(10).to_numpy(dtype=str))
+        is_header = np.isin(cells, ['strike', 'chg in oi value']).any(axis=1)
         
-        if header_row == -1:
+        if not is_header.any():
             return None
+        header_row = int(is_header.argmax())
 
-        df = pd.read_excel(xl, sheet_name=sheet_name, header=header_row)
-        df.columns = df.columns.astype(str).str.strip()
+        # Promote the header row ourselves instead of re-reading the sheet
+        # The Put side repeats the Call headers; number the repeats so they read 'VWAP.1' etc.
+        columns = []
+        seen = {}
+        for name in df_raw.iloc[header_row].astype(str).str.strip():
+            count = seen.get(name, 0)
+            seen[name] = count + 1
+            columns.append(name if count == 0 else f"{name}.{count}")
+        
+        # Strike and Chg in OI Value are essential; the other columns default to 0 when missing
+        if 'Strike' not in columns:
+            print(f"Error reading sheet {sheet_name}: 'Strike' column missing")
+            return None
+        if 'Chg in OI Value' not in columns:
+            return None # Essential column missing
+        
+        # Sheet header -> working column name; the numbered repeats are the Put side
+        raw_map = {
+            'Strike': 'Strike',
+            'Chg in OI Value': 'Call_Chg_OI_Val',
+            'VWAP': 'Call_VWAP',
+            'LTP (Chg %)': 'Call_LTP',
+            'Chg in OI Value.1': 'Put_Chg_OI_Val',
+            'VWAP.1': 'Put_VWAP',
+            'LTP (Chg %).1': 'Put_LTP',
+        }
         
         # Clean columns
-        df['Strike'] = pd.to_numeric(df['Strike'], errors='coerce')
-        if 'Chg in OI Value' in df.columns:
-            df['Call_Chg_OI_Val'] = pd.to_numeric(df['Chg in OI Value'], errors='coerce')
-        else:
-            return None # Essential column missing
-            
-        df['Call_VWAP'] = pd.to_numeric(df.get('VWAP', 0), errors='coerce')
-        df['Call_LTP'] = pd.to_numeric(df.get('LTP (Chg %)', 0), errors='coerce')
+        # Slice the data rows once (missing columns come back as NaN) and convert them in one pass
+        df = df_raw.iloc[header_row + 1:].set_axis(columns, axis=1)
+        df = df.reindex(columns=list(raw_map)).rename(columns=raw_map).apply(pd.to_numeric, errors='coerce')
         
-        # Rename duplicate columns for Put side (usually .1 suffix)
-        cols = df.columns.tolist()
-        if 'Chg in OI Value.1' in cols:
-            df['Put_Chg_OI_Val'] = pd.to_numeric(df['Chg in OI Value.1'], errors='coerce')
-        if 'VWAP.1' in cols:
-            df['Put_VWAP'] = pd.to_numeric(df['VWAP.1'], errors='coerce')
-        if 'LTP (Chg %).1' in cols:
-            df['Put_LTP'] = pd.to_numeric(df['LTP (Chg %).1'], errors='coerce')
-            
-        df = df.dropna(subset=['Strike'])
         # Ensure unique strikes to prevent reindexing errors
-        df = df.drop_duplicates(subset=['Strike'])
-        cols_to_fill = ['Call_Chg_OI_Val', 'Put_Chg_OI_Val', 'Call_VWAP', 'Put_VWAP', 'Call_LTP', 'Put_LTP']
-        for c in cols_to_fill:
-            if c in df.columns:
-                df[c] = df[c].fillna(0)
-            else:
-                df[c] = 0
+        df = df.dropna(subset=['Strike']).drop_duplicates('Strike').fillna(0)
                 
         return df[['Strike', 'Call_Chg_OI_Val', 'Call_VWAP', 'Call_LTP', 'Put_Chg_OI_Val', 'Put_VWAP', 'Put_LTP']]
     except Exception as e:
@@ -79,33 +163,45 @@ def process_excel_file(input_source):
     """
     input_source: Can be a file path (str) or file-like object (bytes).
     Returns: Bytes of the modified Excel file.
+    Results are cached on the input's content, so re-processing the same workbook is free.
     """
     
-    # Load into buffer to allow in-memory modification
+    # Get something openpyxl can load without copying the workbook more than needed
     if isinstance(input_source, str):
+        # openpyxl reads the path directly; only stream the file through the hash here
+        buffer = input_source
         with open(input_source, 'rb') as f:
-            buffer = io.BytesIO(f.read())
+            cache_key = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).digest()
     else:
          # Assume bytes or file-like
-         if hasattr(input_source, 'read'):
+         if hasattr(input_source, 'getvalue'):
+             # Already in memory (e.g. BytesIO): use it directly instead of copying
+             input_source.seek(0)
+             buffer = input_source
+         elif hasattr(input_source, 'read'):
              input_source.seek(0)
              buffer = io.BytesIO(input_source.read())
          else:
+             # BytesIO shares the bytes object until it is written to, so this is not a copy
              buffer = io.BytesIO(input_source)
+         # getvalue() hands back the underlying bytes without copying them
+         cache_key = hashlib.blake2b(buffer.getvalue(), digest_size=16).digest()
+    
+    # Same workbook as a recent run: hand back that result without re-processing
+    with _RESULT_CACHE_LOCK:
+        if cache_key in _RESULT_CACHE:
+            _RESULT_CACHE.move_to_end(cache_key)
+            return _RESULT_CACHE[cache_key]
              
     # Create ExcelFile object for reading
     try:
         # Step 0: Pre-process to add "Change in OI%" columns to Day Sheets
-        # We use openpyxl to modify the buffer in-place (or create new buffer)
-        import openpyxl
-        from openpyxl.utils import get_column_letter
-
+        # We use openpyxl to modify the workbook in memory (the input itself is never written)
         wb = openpyxl.load_workbook(buffer)
         
-        # Regex for day sheets again (need to reuse logic or just regex here)
+        # Same day-sheet regex as get_day_sheets
         sheet_names = wb.sheetnames
-        day_pattern = re.compile(r'^(tue|wed|thu|fri|mon|sun|sat)', re.IGNORECASE)
-        day_sheets_wb = [s for s in sheet_names if day_pattern.match(s) and s.lower() not in ['total', 'max']]
+        day_sheets_wb = [s for s in sheet_names if _DAY_PATTERN.match(s)]
         
         for sheet_name in day_sheets_wb:
             ws = wb[sheet_name]
@@ -233,7 +329,7 @@ def process_excel_file(input_source):
                                         ws.cell(row=r, column=insert_col).value = 0
                             except: pass
                         
-        # Save modified workbook to a new buffer
+        # Save modified workbook to a new buffer for reading; wb itself stays open for writing the output sheets
         new_buffer = io.BytesIO()
         wb.save(new_buffer)
         new_buffer.seek(0)
@@ -241,7 +337,8 @@ def process_excel_file(input_source):
         # Use THIS buffer for the rest of the processing
         buffer = new_buffer
         
-        xl = pd.ExcelFile(buffer)
+        # calamine (Rust) reads much faster than openpyxl; openpyxl is still used for writing
+        xl = pd.ExcelFile(buffer, engine='calamine')
     except Exception as e:
         print(f"Error opening or preprocessing Excel file: {e}")
         return None
@@ -251,9 +348,20 @@ def process_excel_file(input_source):
     
     all_data = []
     
+    if not day_sheets:
+        print("No valid data.")
+        return
+    
     # 1. Process all daily sheets
+    # Load every day sheet in one read_excel call; the per-sheet work below is in memory
+    try:
+        raw_sheets = pd.read_excel(xl, sheet_name=day_sheets, header=None)
+    except Exception as e:
+        print(f"Error reading day sheets: {e}")
+        return None
+    
     for idx, sheet in enumerate(day_sheets):
-        df = process_sheet_data(xl, sheet)
+        df = process_sheet_data(raw_sheets[sheet], sheet)
         if df is not None:
             df['Sheet_Name'] = sheet
             df['Sheet_Index'] = idx
@@ -268,34 +376,19 @@ def process_excel_file(input_source):
     # 2. Consistent Pricing Logic & Metrics Calculation
     # We need to compute Ref_Price for EACH day for the 'Total' sheet
     
-    # Group by Strike to determine if we force LTP
-    grouped = combined.groupby('Strike')
-    
-    strike_pricing_mode = {} # Strike -> 'LTP' or 'Standard'
-    
-    for strike, group in grouped:
-        group = group.sort_values('Sheet_Index')
-        first_day = group.iloc[0]
-        if first_day['Call_VWAP'] <= 0:
-            strike_pricing_mode[strike] = 'LTP'
-        else:
-            strike_pricing_mode[strike] = 'Standard'
+    # Determine per strike if we force LTP: the first day's Call VWAP decides
+    # A stable sort keeps each strike's rows in day order so 'first' is the first day
+    first_vwap = combined.sort_values('Sheet_Index', kind='stable').groupby('Strike', sort=False)['Call_VWAP'].first()
+    pricing_series = pd.Series(np.where(first_vwap.to_numpy() <= 0, 'LTP', 'Standard'), index=first_vwap.index)
             
     # Apply pricing
-    def get_ref_price(row, side='Call'):
-        strike = row['Strike']
-        mode = strike_pricing_mode.get(strike, 'Standard')
-        
-        vwap = row[f'{side}_VWAP']
-        ltp = row[f'{side}_LTP']
-        
-        if mode == 'LTP':
-            return ltp
-        else:
-            return vwap if vwap > 0 else ltp
-
-    combined['Call_Ref_Price'] = combined.apply(lambda r: get_ref_price(r, 'Call'), axis=1)
-    combined['Put_Ref_Price'] = combined.apply(lambda r: get_ref_price(r, 'Put'), axis=1)
+    # Look up each row's strike mode once, then pick LTP or VWAP for the whole column
+    mode_ltp = combined['Strike'].map(pricing_series).eq('LTP').to_numpy()
+    
+    for side in ['Call', 'Put']:
+        vwap = combined[f'{side}_VWAP'].to_numpy()
+        ltp = combined[f'{side}_LTP'].to_numpy()
+        combined[f'{side}_Ref_Price'] = np.where(mode_ltp, ltp, np.where(vwap > 0, vwap, ltp))
     
     combined['Call_BEP'] = combined['Strike'] + combined['Call_Ref_Price']
     combined['Put_BEP'] = combined['Strike'] - combined['Put_Ref_Price']
@@ -307,23 +400,40 @@ def process_excel_file(input_source):
     # Subsequent Days (e.g. Wed): Cumulative Sum (Money) and Cumulative Avg (Ref Price) of ALL days up to that point.
     
     # Base DataFrame with Strike
-    dfs_to_concat = []
     base_df = pd.DataFrame({'Strike': sorted(combined['Strike'].unique())}).set_index('Strike')
     
-    # Initialize Cumulative Trackers
-    cum_ce_money = pd.Series(0, index=base_df.index)
-    cum_pe_money = pd.Series(0, index=base_df.index)
+    # Pivot each metric into a (Strike x Day) matrix so the running totals are one cumsum sweep
+    # Strikes missing on a day stay NaN (0 for money, excluded from the ref average)
+    # Each sheet has unique strikes, so pivot never has to aggregate
+    day_cols = range(len(day_sheets))
+    metrics = ['Call_Chg_OI_Val', 'Put_Chg_OI_Val', 'Call_Ref_Price', 'Put_Ref_Price']
+    wide = combined.pivot(index='Strike', columns='Sheet_Index', values=metrics)
+    wide = wide.reindex(index=base_df.index, columns=pd.MultiIndex.from_product([metrics, day_cols]))
     
-    # Track Ref Prices for Cumulative Average
-    # We need to store all individual ref prices to compute running average
-    # Dictionary mapping Strike -> List of Ref Prices seen so far
-    # Or cleaner: Since we process days sequentially, we can maintain the running sum and count
+    # 1. Cumulative Money
+    # Work on plain (Strike x Day) ndarrays; missing days are 0 and the cumsum runs in place
+    cum_ce_money = wide['Call_Chg_OI_Val'].to_numpy(dtype=np.float64, na_value=0.0)
+    cum_pe_money = wide['Put_Chg_OI_Val'].to_numpy(dtype=np.float64, na_value=0.0)
+    np.cumsum(cum_ce_money, axis=1, out=cum_ce_money)
+    np.cumsum(cum_pe_money, axis=1, out=cum_pe_money)
     
-    cum_ce_ref_sum = pd.Series(0.0, index=base_df.index)
-    cum_ce_ref_count = pd.Series(0, index=base_df.index)
+    # 2. Cumulative Ref Price (Running Average)
+    # Logic: If Day 1, Run Avg = Day 1 Ref.
+    # If Day 2, Run Avg = Mean(Day 1 Ref, Day 2 Ref).
+    # "Use LTP if VWAP missing" logic is already in 'Call_Ref_Price'
+    # Average is over the days the strike is present with a positive ref price.
+    def running_avg(ref_df):
+        ref = ref_df.to_numpy(dtype=np.float64, na_value=0.0)
+        cum_count = np.cumsum(ref > 0, axis=1)
+        # Running sum and division both write back into the same buffer
+        np.cumsum(ref, axis=1, out=ref)
+        # Avoid division by zero: strikes with no priced day yet stay 0
+        np.divide(ref, cum_count, out=ref, where=cum_count > 0)
+        ref[cum_count == 0] = 0
+        return ref
     
-    cum_pe_ref_sum = pd.Series(0.0, index=base_df.index)
-    cum_pe_ref_count = pd.Series(0, index=base_df.index)
+    cum_avg_ce_ref = running_avg(wide['Call_Ref_Price'])
+    cum_avg_pe_ref = running_avg(wide['Put_Ref_Price'])
     
     # Iterate through SORTED day sheets (Order matters for cumulative)
     # day_sheets are ['tue', 'wed', 'thu'...] based on extraction order. 
@@ -332,94 +442,52 @@ def process_excel_file(input_source):
     # We also need a way to pass these cumulative metrics to the Max sheet generator
     # So we'll store the calculated cumulative DFs in a dict
     daily_calculated_dfs = {} 
+    strikes = base_df.index.to_numpy()
+    
+    # Total sheet values: 4 columns per day with a 1-column gap between days, filled in place
+    total_values = np.full((len(strikes), 5 * len(day_sheets) - 1), np.nan)
+    total_columns = []
     
     for idx, sheet in enumerate(day_sheets):
-        # Get daily data
-        day_data = combined[combined['Sheet_Name'] == sheet].set_index('Strike')
-        
-        # Align to base index (fill missing strikes with 0 for money, NaN for ref)
-        day_data = day_data.reindex(base_df.index)
-        
-        # 1. Update Cumulative Money
-        # FillNa(0) for money addition
-        current_ce_money = day_data['Call_Chg_OI_Val'].fillna(0)
-        current_pe_money = day_data['Put_Chg_OI_Val'].fillna(0)
-        
-        cum_ce_money = cum_ce_money.add(current_ce_money, fill_value=0)
-        cum_pe_money = cum_pe_money.add(current_pe_money, fill_value=0)
-        
-        # 2. Update Cumulative Ref Price (Running Average)
-        # Ref price only exists if day_data has it.
-        # Logic: If Day 1, Run Avg = Day 1 Ref.
-        # If Day 2, Run Avg = Mean(Day 1 Ref, Day 2 Ref).
-        # We need to handle if a strike is missing in a day.
-        # "Use LTP if VWAP missing" logic is already in 'Call_Ref_Price'
-        
-        # We need to know if the strike "exists" for this day to include in average?
-        # Or do we include 0? No, defined ref price.
-        # If Strike is present in input, it has a Ref Price (or LTP).
-        # If Strike is NOT present in input for this day, do we carry forward or ignore?
-        # Usually average is over "active" days? Or all days?
-        # Let's assume average over present data points.
-        
-        # Call Ref
-        valid_ce_mask = day_data['Call_Ref_Price'].notna() & (day_data['Call_Ref_Price'] > 0)
-        cum_ce_ref_sum = cum_ce_ref_sum.add(day_data['Call_Ref_Price'].fillna(0), fill_value=0)
-        cum_ce_ref_count = cum_ce_ref_count.add(valid_ce_mask.astype(int), fill_value=0)
-        
-        # Put Ref
-        valid_pe_mask = day_data['Put_Ref_Price'].notna() & (day_data['Put_Ref_Price'] > 0)
-        cum_pe_ref_sum = cum_pe_ref_sum.add(day_data['Put_Ref_Price'].fillna(0), fill_value=0)
-        cum_pe_ref_count = cum_pe_ref_count.add(valid_pe_mask.astype(int), fill_value=0)
-        
-        # Calculate Running Avg
-        # Avoid division by zero
-        avg_ce_ref = cum_ce_ref_sum.div(cum_ce_ref_count).replace([np.inf, -np.inf], 0).fillna(0)
-        avg_pe_ref = cum_pe_ref_sum.div(cum_pe_ref_count).replace([np.inf, -np.inf], 0).fillna(0)
+        # Slice this day's cumulative columns
+        avg_ce_ref = cum_avg_ce_ref[:, idx]
+        avg_pe_ref = cum_avg_pe_ref[:, idx]
         
         # 3. Calculate BEP based on Cumulative Avg Ref
-        ce_bep = base_df.index + avg_ce_ref
-        pe_bep = base_df.index - avg_pe_ref
+        ce_bep = strikes + avg_ce_ref
+        pe_bep = strikes - avg_pe_ref
+        
+        # Money in Crores
+        ce_money = np.round(cum_ce_money[:, idx] / 10000000, 2)
+        pe_money = np.round(cum_pe_money[:, idx] / 10000000, 2)
         
-        # 4. Construct DataFrame for this Day
+        # 4. Fill this Day's block of the Total sheet
         # Columns: CE BEP, CE Money (Cumulative), PE Money (Cumulative), PE BEP
+        # Note: Columns are effectively "Cumulative up to SheetName"
+        start = idx * 5
+        total_values[:, start] = ce_bep
+        total_values[:, start + 1] = ce_money
+        total_values[:, start + 2] = pe_money
+        total_values[:, start + 3] = pe_bep
+        total_columns.extend((sheet, metric) for metric in ['CE BEP', 'CE Money', 'PE Money', 'PE BEP'])
         
-        subset = pd.DataFrame(index=base_df.index)
-        subset['CE BEP'] = ce_bep
-        subset['CE Money'] = round(cum_ce_money / 10000000, 2)
-        subset['PE Money'] = round(cum_pe_money / 10000000, 2)
-        subset['PE BEP'] = pe_bep
+        # Gap Column (stays NaN), except after the last day
+        if idx < len(day_sheets) - 1:
+            total_columns.append(('', ''))
         
         # Store for Max Sheet usage
         # We need to store the Avg Ref as well for Max Sheet levels
-        subset['Avg CE Ref'] = avg_ce_ref
-        subset['Avg PE Ref'] = avg_pe_ref
-        daily_calculated_dfs[sheet] = subset.copy()
-        
-        # Drop aux cols for Total Sheet display
-        display_subset = subset[['CE BEP', 'CE Money', 'PE Money', 'PE BEP']]
-        
-        # Create MultiIndex: (SheetName, Metric)
-        # Note: Columns are effectively "Cumulative up to SheetName"
-        columns = pd.MultiIndex.from_product([[sheet], display_subset.columns])
-        display_subset.columns = columns
-        
-        dfs_to_concat.append(display_subset)
-        
-        # Add Gap Column
-        gap_df = pd.DataFrame(index=base_df.index, columns=pd.MultiIndex.from_tuples([('', '')]))
-        dfs_to_concat.append(gap_df)
-        
-    # Remove last gap
-    if dfs_to_concat:
-        dfs_to_concat.pop()
-        
-    # Concatenate all daily blocks
-    final_total_df = pd.concat([base_df] + dfs_to_concat, axis=1)
-    
-    # Force MultiIndex conversion
-    if isinstance(final_total_df.columns, pd.Index) and not isinstance(final_total_df.columns, pd.MultiIndex):
-        final_total_df.columns = pd.MultiIndex.from_tuples(final_total_df.columns)
+        # Plain arrays aligned with the strike grid; the Max sheet only indexes into them
+        daily_calculated_dfs[sheet] = {
+            'strikes': strikes,
+            'ce_money': ce_money,
+            'pe_money': pe_money,
+            'ce_ref': avg_ce_ref,
+            'pe_ref': avg_pe_ref,
+        }
+        
+    # Build the Total sheet once from the filled array: (SheetName, Metric) headers, strikes as the index
+    final_total_df = pd.DataFrame(total_values, index=base_df.index, columns=pd.MultiIndex.from_tuples(total_columns))
     
     # 5. Build 'Max' Sheet Data (Day-by-Day Summary)
     # Using the CUMULATIVE data we just calculated
@@ -427,17 +495,28 @@ def process_excel_file(input_source):
     max_dfs = []
     
     # Helper for Max Summary
-    def get_top5_df(df_source, ce_metric, pe_metric, label):
-        # Metrics are already in df_source (which is the cumulative subset for that day)
-        
-        # Sort Calls (Top 5 by OI - Cumulative)
-        top_calls = df_source.sort_values(ce_metric, ascending=False).head(5)
-        # Sort Puts (Top 5 by OI - Cumulative)
-        top_puts = df_source.sort_values(pe_metric, ascending=False).head(5)
+    def get_top5_df(stats, label):
+        # Metrics are already in stats (the cumulative arrays for that day, aligned with stats['strikes'])
+        day_strikes = stats['strikes']
+        ce_money = stats['ce_money']
+        pe_money = stats['pe_money']
+        
+        def top5_positions(money):
+            # Top 5 by OI - Cumulative, selected in O(N) instead of sorting every strike
+            if len(money) > 5:
+                # 5th largest value; everything above it is in, ties at it are taken in strike order
+                kth = np.partition(money, len(money) - 5)[len(money) - 5]
+                above = np.flatnonzero(money > kth)
+                ties = np.flatnonzero(money == kth)[:5 - len(above)]
+                top_idx = np.concatenate((above, ties))
+            else:
+                top_idx = np.arange(len(money))
+            # Re-sort by Strike (descending); only the selected 5 are sorted
+            return top_idx[np.argsort(day_strikes[top_idx])[::-1]]
         
-        # Re-sort by Strike
-        top_calls = top_calls.sort_index(ascending=False)
-        top_puts = top_puts.sort_index(ascending=False)
+        # Sort Calls / Puts
+        top_calls = top5_positions(ce_money)
+        top_puts = top5_positions(pe_money)
         
         # Re-sort for display (Ease of viewing)
         # However, the user's image shows R1, R2, R3, R4, R5 tags next to the rows.
@@ -465,53 +544,36 @@ def process_excel_file(input_source):
         # Unless user explicitly asks to revert to Rank order. 
         # The image 2 might just be an example of structure.
         
-        # Calculate Sums (Data is ALREADY scaled to Crores in subset)
-        ce_money_sum = top_calls[ce_metric].sum()
-        pe_money_sum = top_puts[pe_metric].sum()
-        
-        res_data = []
-        for strike in top_calls.index:
-            val = top_calls.loc[strike, ce_metric]
-            ref = round(top_calls.loc[strike, 'Avg CE Ref'], 2)
-            res_data.append([strike, val, ref, strike+ref])
-            
-        sup_data = []
-        for strike in top_puts.index:
-            val = top_puts.loc[strike, pe_metric]
-            ref = round(top_puts.loc[strike, 'Avg PE Ref'], 2)
-            sup_data.append([strike, val, ref, strike-ref])
-            
-        # Ensure 5 rows
-        while len(res_data) < 5: res_data.append([np.nan]*4)
-        while len(sup_data) < 5: sup_data.append([np.nan]*4)
-        
-        # Add a Total Row (Index 6)
-        res_data.append([np.nan, ce_money_sum, np.nan, np.nan])
-        sup_data.append([np.nan, pe_money_sum, np.nan, np.nan])
-        
-        # Columns based on User Request: CE Strike | Money | AVWAP | CE BEP
-        res_df = pd.DataFrame(res_data, columns=['CE Strike', 'Money', 'AVWAP', 'CE BEP'])
-        sup_df = pd.DataFrame(sup_data, columns=['PE Strike', 'Money', 'AVWAP', 'PE BEP'])
-        
-        # Columns based on User Request: CE Strike | Money | AVWAP | CE BEP
-        res_df = pd.DataFrame(res_data, columns=['CE Strike', 'Money', 'AVWAP', 'CE BEP'])
-        sup_df = pd.DataFrame(sup_data, columns=['PE Strike', 'Money', 'AVWAP', 'PE BEP'])
-        
-        # Add 1 blank column between CE and PE (User Request: 1 col between CE/PE)
-        gap_inner = pd.DataFrame(index=range(len(res_df)), columns=['']) # 1 col
-        
-        block = pd.concat([res_df, gap_inner, sup_df], axis=1)
-        
-        # Restore MultiIndex Header
-        block.columns = pd.MultiIndex.from_product([[label], block.columns])
+        # One preallocated block: rows 0-4 hold the top strikes (NaN when fewer), row 5 the Total row
+        # Columns based on User Request: CE Strike | Money | AVWAP | CE BEP | gap | PE Strike | Money | AVWAP | PE BEP
+        block_values = np.full((6, 9), np.nan)
+        
+        ce_ref = np.round(stats['ce_ref'][top_calls], 2)
+        block_values[:len(top_calls), 0] = day_strikes[top_calls]
+        block_values[:len(top_calls), 1] = ce_money[top_calls]
+        block_values[:len(top_calls), 2] = ce_ref
+        block_values[:len(top_calls), 3] = day_strikes[top_calls] + ce_ref
+        
+        pe_ref = np.round(stats['pe_ref'][top_puts], 2)
+        block_values[:len(top_puts), 5] = day_strikes[top_puts]
+        block_values[:len(top_puts), 6] = pe_money[top_puts]
+        block_values[:len(top_puts), 7] = pe_ref
+        block_values[:len(top_puts), 8] = day_strikes[top_puts] - pe_ref
+        
+        # Total Row: Sums (Data is ALREADY scaled to Crores)
+        block_values[5, 1] = ce_money[top_calls].sum()
+        block_values[5, 6] = pe_money[top_puts].sum()
+        
+        # Column 4 stays blank (User Request: 1 col between CE/PE)
+        columns = ['CE Strike', 'Money', 'AVWAP', 'CE BEP', '', 'PE Strike', 'Money', 'AVWAP', 'PE BEP']
+        block = pd.DataFrame(block_values, columns=pd.MultiIndex.from_product([[label], columns]))
         return block
 
     # Generate Max blocks 
     for sheet in day_sheets:
         if sheet in daily_calculated_dfs:
             stats = daily_calculated_dfs[sheet]
-            # pass 'CE Money', 'PE Money' as they are the column names in stats
-            block = get_top5_df(stats, 'CE Money', 'PE Money', sheet)
+            block = get_top5_df(stats, sheet)
             max_dfs.append(block)
             
             # Add gap between DAYS (User Request: 2 cols between days)
@@ -530,112 +592,89 @@ def process_excel_file(input_source):
     # 6. Write to Excel and Style
     print("Writing to Excel...")
     
-    from openpyxl.styles import Border, Side, Alignment, Font
-    from openpyxl.utils import get_column_letter
+    # Write straight into the workbook loaded (and pre-processed) above instead of re-parsing
+    # the buffer through pd.ExcelWriter; only the Total and Max sheets are rebuilt.
+    ws_total = write_sheet(wb, 'Total', final_total_df)
+    ws_max = write_sheet(wb, 'Max', final_max_df)
     
-    # We use the buffer for writing. 'mode=a' requires an existing file/buffer content.
-    # buffer already has the original file content.
-    buffer.seek(0)
+    # --- Styling Max Sheet ---
+    ws_max.column_dimensions['A'].hidden = True # Hide Index
     
-    with pd.ExcelWriter(buffer, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
-        final_total_df.to_excel(writer, sheet_name='Total') 
-        final_max_df.to_excel(writer, sheet_name='Max', index=True)
-        
-        # --- Styling Max Sheet ---
-        ws_max = writer.sheets['Max']
-        ws_max.column_dimensions['A'].hidden = True # Hide Index
-        
-        # Styles
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-        no_border = Border()
-        
-        # Max Sheet Logic
-        max_start_row = 3
-        max_end_row = 8
-        current_col = 2
-        
-        for item in max_dfs:
-            # Check Gap
-            is_gap = False
-            if isinstance(item.columns, pd.MultiIndex):
-                if str(item.columns[0][0]).strip() == '':
-                     is_gap = True
-            
-            width = len(item.columns)
+    # Styles
+    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    no_border = Border()
+    
+    # Register the grid style once; cells then just reference it by name
+    if 'grid_thin' not in wb.named_styles:
+        wb.add_named_style(NamedStyle(name='grid_thin', border=thin_border))
+    
+    # Max Sheet Logic
+    max_start_row = 3
+    max_end_row = 8
+    current_col = 2
+    
+    # Walk each rectangle with iter_rows instead of looking every cell up through ws.cell()
+    def apply_box_grid(ws, r0, r1, c0, c1, border):
+        for row in ws.iter_rows(min_row=r0, max_row=r1, min_col=c0, max_col=c1):
+            for cell in row:
+                cell.border = border
+    
+    def apply_grid_style(ws, r0, r1, c0, c1):
+        for row in ws.iter_rows(min_row=r0, max_row=r1, min_col=c0, max_col=c1):
+            for cell in row:
+                cell.style = 'grid_thin'
+    
+    for item in max_dfs:
+        # Check Gap
+        is_gap = False
+        if isinstance(item.columns, pd.MultiIndex):
+            if str(item.columns[0][0]).strip() == '':
+                 is_gap = True
+        
+        width = len(item.columns)
+        
+        if is_gap:
+            # Clear Borders for Gap Columns
+            # Only the header rows carry borders (from the header style); data cells start without one
+            apply_box_grid(ws_max, 1, 2, current_col, current_col + width - 1, no_border)
+        else:
+            # Data Block
+            ce_first, ce_last = current_col, current_col + 3
+            gap_col = current_col + 4
+            pe_first, pe_last = current_col + 5, current_col + 8
             
-            if is_gap:
-                # Clear Borders for Gap Columns
-                for c_offset in range(width):
-                    col_idx = current_col + c_offset
-                    column_letter = get_column_letter(col_idx)
-                    # Clear header rows
-                    ws_max.cell(row=1, column=col_idx).border = no_border
-                    ws_max.cell(row=2, column=col_idx).border = no_border
-                    # Clear data rows
-                    for r in range(max_start_row, max_end_row + 1):
-                        ws_max.cell(row=r, column=col_idx).border = no_border
-            else:
-                # Data Block
-                ce_cols = range(current_col, current_col + 4)
-                gap_col = current_col + 4
-                pe_cols = range(current_col + 5, current_col + 9)
-                
-                def apply_box_grid(ws, rows, cols, border):
-                    for r in rows:
-                        for c in cols:
-                            ws.cell(row=r, column=c).border = border
-                            
-                # Apply Borders to CE Table (Header + Data)
-                apply_box_grid(ws_max, [2], ce_cols, thin_border) # Header
-                apply_box_grid(ws_max, range(max_start_row, max_end_row + 1), ce_cols, thin_border)
-                
-                # Apply Borders to PE Table (Header + Data)
-                apply_box_grid(ws_max, [2], pe_cols, thin_border) # Header
-                apply_box_grid(ws_max, range(max_start_row, max_end_row + 1), pe_cols, thin_border)
-
-                # Ensure Inner Gap is Clean
-                ws_max.cell(row=1, column=gap_col).border = no_border
-                ws_max.cell(row=2, column=gap_col).border = no_border
-                for r in range(max_start_row, max_end_row + 1):
-                    ws_max.cell(row=r, column=gap_col).border = no_border
-                    
-            current_col += width
+            # Apply Borders to CE/PE Tables (Header + Data)
+            # Header cells keep their header font/alignment, so only their border is set
+            apply_box_grid(ws_max, 2, 2, ce_first, ce_last, thin_border) # Header
+            apply_box_grid(ws_max, 2, 2, pe_first, pe_last, thin_border) # Header
+            apply_grid_style(ws_max, max_start_row, max_end_row, ce_first, ce_last)
+            apply_grid_style(ws_max, max_start_row, max_end_row, pe_first, pe_last)
 
-        # --- Styling Total Sheet ---
-        ws_total = writer.sheets['Total']
-        
-        # Col index mapping: DataFrame col i -> Excel col i + 2 (A is Index)
-        for i, col_tuple in enumerate(final_total_df.columns):
-            if str(col_tuple[0]).strip() == '':
-                excel_col_idx = i + 2
-                # Clear borders for this column
-                # Rows: 1 to len(final_total_df) + 2 (Header)
-                total_rows = len(final_total_df) + 2
-                for r in range(1, total_rows + 1):
-                    ws_total.cell(row=r, column=excel_col_idx).border = no_border
-                    
-        # Auto-fit Columns for BOTH sheets
-        for ws in [ws_max, ws_total]:
-            for col in ws.columns:
-                max_length = 0
-                # Get column letter from the first cell
-                col_idx = col[0].column
-                column_letter = get_column_letter(col_idx)
+            # Ensure Inner Gap is Clean (header rows only)
+            apply_box_grid(ws_max, 1, 2, gap_col, gap_col, no_border)
                 
-                if ws == ws_max and column_letter == 'A': continue # Skip hidden index
-                
-                for cell in col:
-                    try:
-                        val = cell.value
-                        if val:
-                            if len(str(val)) > max_length:
-                                max_length = len(str(val))
-                    except:
-                        pass
+        current_col += width
+
+    # --- Styling Total Sheet ---
+    # Col index mapping: DataFrame col i -> Excel col i + 2 (A is Index)
+    for i, col_tuple in enumerate(final_total_df.columns):
+        if str(col_tuple[0]).strip() == '':
+            excel_col_idx = i + 2
+            # Clear borders for this column
+            # Only the two header rows are styled; data cells have no border to clear
+            apply_box_grid(ws_total, 1, 2, excel_col_idx, excel_col_idx, no_border)
                 
-                # Add a bit of padding
-                adjusted_width = (max_length + 2)
-                ws.column_dimensions[column_letter].width = adjusted_width
+    # Auto-fit Columns for BOTH sheets
+    # Widths come from the DataFrames, not a walk over every written cell
+    # Total: column A is the Strike index (with its name as a label), data starts at B
+    index_width = max(len(str(final_total_df.index.name)), final_total_df.index.map(lambda v: len(str(v))).max())
+    ws_total.column_dimensions['A'].width = index_width + 2
+    for i, width in enumerate(get_column_widths(final_total_df), start=2):
+        ws_total.column_dimensions[get_column_letter(i)].width = width
+    
+    # Max: column A is the hidden blank index, data starts at B
+    for i, width in enumerate(get_column_widths(final_max_df), start=2):
+        ws_max.column_dimensions[get_column_letter(i)].width = width
 
     # 7. Generate Pine Script for the LAST day
     pine_script = ""
@@ -731,7 +770,15 @@ if barstate.islast
             print(f"Error generating Pine Script: {e}")
 
     # Return the modified bytes AND the pine script
-    return buffer.getvalue(), pine_script
+    output = io.BytesIO()
+    wb.save(output)
+    result = (output.getvalue(), pine_script)
+    
+    with _RESULT_CACHE_LOCK:
+        _RESULT_CACHE[cache_key] = result
+        if len(_RESULT_CACHE) > _RESULT_CACHE_SIZE:
+            _RESULT_CACHE.popitem(last=False)
+    return result
 
 if __name__ == "__main__":
     file_path = 'Nifty 10th Feb expiry - 1.xlsx'
@@ -1,8 +1,14 @@
 
 import requests
-import json
 import time
 
+# One session for the module so repeated calls reuse the TCP/TLS connection
+_SESSION = requests.Session()
+_SESSION.headers.update({
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
+    "Content-Type": "application/x-www-form-urlencoded"
+})
+
 def get_gift_nifty_price():
     url = "https://scanner.tradingview.com/global/scan"
     
@@ -15,13 +21,9 @@ def get_gift_nifty_price():
         "columns": ["close", "time"]
     }
     
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36",
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    
     try:
-        response = requests.post(url, data=json.dumps(payload), headers=headers)
+        # The session's Content-Type header takes precedence over the one json= would set
+        response = _SESSION.post(url, json=payload, timeout=5)
         response.raise_for_status()
         
         data = response.json()